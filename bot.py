@@ -1,20 +1,36 @@
 """Discord bot that provides random voice channel utilities via slash commands."""
 from __future__ import annotations
 
+import argparse
 import asyncio
+import hashlib
+import heapq
+import itertools
 import json
 import os
 import random
+import threading
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, List, Mapping
 
 from dotenv import load_dotenv
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library when orjson is unavailable.
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows; use the default event loop.
+    uvloop = None
+
 load_dotenv()
 TOKEN_ENV_VAR = "DISCORD_BOT_TOKEN"
 
@@ -30,7 +46,8 @@ def get_token() -> str:
     return token
 
 
-intents = discord.Intents.all()
+# Only subscribe to the gateway events the commands rely on.
+intents = discord.Intents.none()
 intents.guilds = True
 intents.members = True
 intents.voice_states = True
@@ -39,16 +56,34 @@ intents.voice_states = True
 class TeamBot(commands.Bot):
     """Custom bot implementation that synchronizes application commands."""
 
+    persist_task: asyncio.Task[None] | None = None
+    # Set from the --sync command line flag to sync commands even if they look unchanged.
+    force_command_sync: bool = False
+
     async def setup_hook(self) -> None:  # type: ignore[override]
-        await sync_application_commands(self)
+        await sync_command_tree_if_changed(self, force=self.force_command_sync)
         if not prune_team_state_loop.is_running():
             prune_team_state_loop.start()
+        if self.persist_task is None:
+            self.persist_task = asyncio.create_task(persist_team_state_worker())
+
+    async def close(self) -> None:  # type: ignore[override]
+        if self.persist_task is not None:
+            self.persist_task.cancel()
+            self.persist_task = None
+        # Flush any change still waiting on the debounce window or left over from a failed write;
+        # the digest check makes this a no-op when the file is already current.
+        _PERSIST_REQUESTED.clear()
+        persist_team_state()
+        await super().close()
 
 
-bot = TeamBot(command_prefix="!", intents=intents)
+# Members in voice channels arrive with GUILD_CREATE and voice state events, and other
+# members are resolved on demand, so there is no need to download every guild's member list.
+bot = TeamBot(command_prefix="!", intents=intents, chunk_guilds_at_startup=False)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TeamAssignment:
     """Represent the latest team assignment for a voice channel."""
 
@@ -56,7 +91,7 @@ class TeamAssignment:
     blue_team_ids: List[int]
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TeamDestinations:
     """Represent the most recent destination channels used for a voice channel."""
 
@@ -64,91 +99,431 @@ class TeamDestinations:
     blue_voice_id: int
 
 
-# Mapping of voice channel ID to the most recent team assignments.
-LAST_TEAM_ASSIGNMENTS: Dict[int, TeamAssignment] = {}
+class AsyncTokenBucket:
+    """Token bucket rate limiter that lets callers burst up to ``capacity`` then pace at ``rate``."""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and consume it."""
+        # Holding the lock while sleeping hands out tokens in FIFO order.
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+# Upper bound on tracked voice channels; the least recently updated channel is evicted first.
+# Evicted entries are compacted out of the expiry heap too, keeping it within twice the tracked entries.
+TEAM_STATE_MAX_CHANNELS = 1024
+
+# Mapping of voice channel ID to the most recent team assignments, oldest update first.
+LAST_TEAM_ASSIGNMENTS: OrderedDict[int, TeamAssignment] = OrderedDict()
 
 # Mapping of voice channel ID to when the assignment was last updated.
 LAST_TEAM_ASSIGNMENT_UPDATED: Dict[int, float] = {}
 
-# Mapping of voice channel ID to the destination channels used in /move_teams.
-LAST_TEAM_DESTINATIONS: Dict[int, TeamDestinations] = {}
+# Mapping of voice channel ID to the destination channels used in /move_teams, oldest first.
+LAST_TEAM_DESTINATIONS: OrderedDict[int, TeamDestinations] = OrderedDict()
 
 # Mapping of voice channel ID to when the destination entry was last updated.
 LAST_TEAM_DESTINATION_UPDATED: Dict[int, float] = {}
 
+# Min-heap of (updated_at, channel_id, kind) so pruning only touches expired entries.
+# Entries are removed lazily: a popped entry is ignored once its channel was updated again,
+# and the heap is rebuilt from the live timestamps once dead entries outnumber live ones.
+_EXPIRY_HEAP: List[tuple[float, int, str]] = []
+
+# Hash of the application commands as of the last successful sync, to skip redundant syncs.
+COMMAND_TREE_HASH_FILE = Path(__file__).resolve().with_name(".command_tree_hash")
+
 # Persist team data to disk so the bot can survive restarts and longer downtimes.
 TEAM_STATE_FILE = Path(__file__).resolve().with_name("team_state.json")
 TEAM_STATE_VERSION = 1
 # Keep team information for one week before automatically pruning it.
 TEAM_STATE_TTL_SECONDS = 7 * 24 * 60 * 60
+# Re-record unchanged destinations at most once a day, just to push back their expiry.
+TEAM_STATE_REFRESH_SECONDS = 24 * 60 * 60
 
-# Delay between individual member moves to stay under Discord's rate limits.
-MEMBER_MOVE_DELAY_SECONDS = 0.5
+# Digest of the last payload written to TEAM_STATE_FILE, used to skip redundant writes.
+_LAST_PERSISTED_DIGEST: bytes | None = None
 
+# Serializes writers so an in-flight threaded write never races a shutdown flush.
+_STATE_WRITE_LOCK = threading.Lock()
+
+# Wait this long after a state change before writing so bursts of commands share one write.
+PERSIST_DEBOUNCE_SECONDS = 2.0
+
+# Set whenever in-memory team state changes and still needs to be written to disk.
+_PERSIST_REQUESTED = asyncio.Event()
+
+# Per-guild member move pacing: sustained moves per second and the allowed burst size.
+MEMBER_MOVE_RATE_PER_SECOND = 10.0
+MEMBER_MOVE_BURST = 10
+
+# Maximum number of user IDs Discord accepts in a single guild member query.
+MEMBER_QUERY_BATCH_SIZE = 100
+
+# Mapping of guild ID to the rate limiter used for moving its members between channels.
+MEMBER_MOVE_BUCKETS: Dict[int, AsyncTokenBucket] = {}
+
+# Mapping of voice channel ID to its non-bot members, kept current by on_voice_state_update.
+_NONBOT_MEMBER_CACHE: Dict[int, List[discord.Member]] = {}
+
+
+def get_member_move_bucket(guild_id: int) -> AsyncTokenBucket:
+    """Return the member move rate limiter for a guild, creating it on first use."""
+    bucket = MEMBER_MOVE_BUCKETS.get(guild_id)
+    if bucket is None:
+        bucket = MEMBER_MOVE_BUCKETS[guild_id] = AsyncTokenBucket(
+            MEMBER_MOVE_RATE_PER_SECOND, MEMBER_MOVE_BURST
+        )
+    return bucket
+
+
+async def resolve_members(
+    guild: discord.Guild,
+    member_ids: Iterable[int],
+    cache: Dict[int, discord.Member | None],
+) -> Dict[int, discord.Member | None]:
+    """Resolve member IDs into ``cache``, querying Discord only for uncached members.
+
+    IDs that cannot be resolved map to None. ``cache`` is returned for convenience.
+    """
+    missing: list[int] = []
+    for member_id in member_ids:
+        if member_id in cache:
+            continue
+        member = guild.get_member(member_id)
+        if member is not None:
+            cache[member_id] = member
+        else:
+            missing.append(member_id)
+
+    # query_members resolves up to 100 IDs per gateway request instead of one REST call each.
+    for start in range(0, len(missing), MEMBER_QUERY_BATCH_SIZE):
+        batch = missing[start:start + MEMBER_QUERY_BATCH_SIZE]
+        try:
+            found = await guild.query_members(user_ids=batch, limit=len(batch), cache=True)
+        except (asyncio.TimeoutError, discord.ClientException):
+            found = []
+        found_by_id = {member.id: member for member in found}
+        for member_id in batch:
+            cache[member_id] = found_by_id.get(member_id)
+
+    return cache
+
+
+async def move_members_to(
+    member_ids: Iterable[int],
+    resolved_members: Mapping[int, discord.Member | None],
+    destination: discord.VoiceChannel,
+    bucket: AsyncTokenBucket,
+) -> tuple[list[str], list[str]]:
+    """Move members into ``destination`` concurrently, returning moved mentions and skip notes."""
+    moved_mentions: list[str] = []
+    skipped_messages: list[str] = []
+    needs_move: list[discord.Member] = []
+
+    # Settle everyone who needs no API call up front so gather only schedules real moves.
+    for member_id in member_ids:
+        member = resolved_members.get(member_id)
+        if member is None:
+            skipped_messages.append(f"<@{member_id}> (not found)")
+        elif member.bot:
+            continue
+        elif member.voice is None or member.voice.channel is None:
+            skipped_messages.append(f"{member.mention} (not in a voice channel)")
+        elif member.voice.channel.id == destination.id:
+            moved_mentions.append(member.mention)
+        else:
+            needs_move.append(member)
+
+    async def move_member(member: discord.Member) -> str | None:
+        await bucket.acquire()
+        try:
+            await member.move_to(destination)
+        except (discord.HTTPException, discord.Forbidden) as exc:
+            return f"{member.mention} (failed to move: {exc})"
+        return None
+
+    failures = await asyncio.gather(*(move_member(member) for member in needs_move))
+    for member, failure in zip(needs_move, failures):
+        if failure is None:
+            moved_mentions.append(member.mention)
+        else:
+            skipped_messages.append(failure)
+
+    return moved_mentions, skipped_messages
+
+
+def get_nonbot_members(channel: discord.VoiceChannel) -> List[discord.Member]:
+    """Return the non-bot members of a voice channel, reusing the cached roster if still valid."""
+    members = _NONBOT_MEMBER_CACHE.get(channel.id)
+    if members is None:
+        members = [member for member in channel.members if not member.bot]
+        _NONBOT_MEMBER_CACHE[channel.id] = members
+    return members
+
+
+def forget_guild_rosters(guild: discord.Guild) -> None:
+    """Drop cached voice rosters for a guild whose voice state updates may have been missed."""
+    for channel in guild.channels:
+        _NONBOT_MEMBER_CACHE.pop(channel.id, None)
+
+
+def encode_team_state(data: dict) -> bytes:
+    """Serialize team state to compact JSON bytes, preferring orjson when available.
+
+    Integer channel ID keys are written as JSON strings by both encoders.
+    """
+
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def decode_team_state(raw: bytes) -> dict:
+    """Parse team state JSON bytes, preferring orjson when available."""
+
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
-def persist_team_state() -> None:
-    """Write team assignments and destinations to disk."""
 
-    data = {
+def _build_state_dict() -> dict:
+    """Snapshot team assignments and destinations into a JSON-serializable dict."""
+
+    assignments: dict[int, dict] = {}
+    # Walk the ordered record maps so identical state always encodes to identical bytes.
+    for channel_id, assignment in LAST_TEAM_ASSIGNMENTS.items():
+        updated_at = LAST_TEAM_ASSIGNMENT_UPDATED.get(channel_id)
+        if updated_at is None:
+            continue
+        assignments[channel_id] = {
+            "red_team_ids": assignment.red_team_ids,
+            "blue_team_ids": assignment.blue_team_ids,
+            "updated_at": updated_at,
+        }
+
+    destinations: dict[int, dict] = {}
+    for channel_id, destination in LAST_TEAM_DESTINATIONS.items():
+        updated_at = LAST_TEAM_DESTINATION_UPDATED.get(channel_id)
+        if updated_at is None:
+            continue
+        destinations[channel_id] = {
+            "red_voice_id": destination.red_voice_id,
+            "blue_voice_id": destination.blue_voice_id,
+            "updated_at": updated_at,
+        }
+
+    return {
         "version": TEAM_STATE_VERSION,
-        "assignments": {
-            str(channel_id): {
-                "red_team_ids": assignment.red_team_ids,
-                "blue_team_ids": assignment.blue_team_ids,
-                "updated_at": LAST_TEAM_ASSIGNMENT_UPDATED[channel_id],
-            }
-            for channel_id, assignment in LAST_TEAM_ASSIGNMENTS.items()
-            if channel_id in LAST_TEAM_ASSIGNMENT_UPDATED
-        },
-        "destinations": {
-            str(channel_id): {
-                "red_voice_id": destinations.red_voice_id,
-                "blue_voice_id": destinations.blue_voice_id,
-                "updated_at": LAST_TEAM_DESTINATION_UPDATED[channel_id],
-            }
-            for channel_id, destinations in LAST_TEAM_DESTINATIONS.items()
-            if channel_id in LAST_TEAM_DESTINATION_UPDATED
-        },
+        "assignments": assignments,
+        "destinations": destinations,
     }
 
+
+def _encode_pending_state() -> tuple[bytes, bytes] | None:
+    """Return the encoded state and its digest, or None if it matches the last write."""
+
+    payload = encode_team_state(_build_state_dict())
+    digest = hashlib.blake2b(payload, digest_size=16).digest()
+    if digest == _LAST_PERSISTED_DIGEST:
+        return None
+    return payload, digest
+
+
+def _write_state_blob(payload: bytes) -> bool:
+    """Atomically replace the state file with ``payload``; blocking, safe to run in a thread."""
+
     tmp_path = TEAM_STATE_FILE.with_suffix(".tmp")
-    try:
-        tmp_path.write_text(json.dumps(data, indent=2, sort_keys=True))
-        tmp_path.replace(TEAM_STATE_FILE)
-    except OSError as exc:
-        print(f"Failed to persist team state: {exc}")
+    with _STATE_WRITE_LOCK:
+        try:
+            with tmp_path.open("wb") as tmp_file:
+                tmp_file.write(payload)
+                tmp_file.flush()
+                # Make sure the data reaches disk before the rename makes it visible.
+                os.fsync(tmp_file.fileno())
+            tmp_path.replace(TEAM_STATE_FILE)
+        except OSError as exc:
+            print(f"Failed to persist team state: {exc}")
+            return False
+    return True
+
+
+def persist_team_state() -> None:
+    """Write team assignments and destinations to disk if they changed."""
+
+    global _LAST_PERSISTED_DIGEST
+
+    pending = _encode_pending_state()
+    if pending is None:
+        return
+
+    payload, digest = pending
+    if _write_state_blob(payload):
+        _LAST_PERSISTED_DIGEST = digest
+
+
+async def persist_team_state_async() -> None:
+    """Like persist_team_state, but performs the file write in a worker thread."""
+
+    global _LAST_PERSISTED_DIGEST
+
+    # Encode on the event loop so the snapshot cannot race with command handlers.
+    pending = _encode_pending_state()
+    if pending is None:
+        return
+
+    payload, digest = pending
+    if await asyncio.to_thread(_write_state_blob, payload):
+        _LAST_PERSISTED_DIGEST = digest
+    else:
+        # Keep the change pending so the worker retries it after the next debounce window.
+        _PERSIST_REQUESTED.set()
+
+
+def schedule_persist() -> None:
+    """Ask the background writer to persist team state after the debounce window."""
+
+    _PERSIST_REQUESTED.set()
+
+
+def _evict_least_recent(entries: OrderedDict[int, object], timestamps: Dict[int, float]) -> None:
+    """Evict the least recently updated channels once ``entries`` exceeds its bound."""
+
+    while len(entries) > TEAM_STATE_MAX_CHANNELS:
+        channel_id, _ = entries.popitem(last=False)
+        timestamps.pop(channel_id, None)
+        schedule_persist()
+
+
+def _push_expiry(updated_at: float, channel_id: int, kind: str) -> None:
+    """Track an entry's expiry, compacting the heap once stale entries dominate it."""
+
+    heapq.heappush(_EXPIRY_HEAP, (updated_at, channel_id, kind))
+    live = len(LAST_TEAM_ASSIGNMENT_UPDATED) + len(LAST_TEAM_DESTINATION_UPDATED)
+    if len(_EXPIRY_HEAP) > 2 * live:
+        _EXPIRY_HEAP[:] = [
+            (timestamp, entry_id, "assignment")
+            for entry_id, timestamp in LAST_TEAM_ASSIGNMENT_UPDATED.items()
+        ]
+        _EXPIRY_HEAP.extend(
+            (timestamp, entry_id, "destination")
+            for entry_id, timestamp in LAST_TEAM_DESTINATION_UPDATED.items()
+        )
+        heapq.heapify(_EXPIRY_HEAP)
+
+
+def record_team_assignment(
+    channel_id: int, assignment: TeamAssignment, updated_at: float
+) -> None:
+    """Store the latest team assignment for a voice channel and track its expiry."""
+
+    LAST_TEAM_ASSIGNMENTS[channel_id] = assignment
+    LAST_TEAM_ASSIGNMENTS.move_to_end(channel_id)
+    LAST_TEAM_ASSIGNMENT_UPDATED[channel_id] = updated_at
+    _evict_least_recent(LAST_TEAM_ASSIGNMENTS, LAST_TEAM_ASSIGNMENT_UPDATED)
+    _push_expiry(updated_at, channel_id, "assignment")
+
+
+def record_team_destinations(
+    channel_id: int, destinations: TeamDestinations, updated_at: float
+) -> None:
+    """Store the latest destination channels for a voice channel and track their expiry."""
+
+    LAST_TEAM_DESTINATIONS[channel_id] = destinations
+    LAST_TEAM_DESTINATIONS.move_to_end(channel_id)
+    LAST_TEAM_DESTINATION_UPDATED[channel_id] = updated_at
+    _evict_least_recent(LAST_TEAM_DESTINATIONS, LAST_TEAM_DESTINATION_UPDATED)
+    _push_expiry(updated_at, channel_id, "destination")
+
+
+def forget_channel_state(channel_id: int) -> None:
+    """Drop every team record kept for a voice channel, e.g. after it was deleted."""
+
+    removed = LAST_TEAM_ASSIGNMENTS.pop(channel_id, None) is not None
+    removed |= LAST_TEAM_DESTINATIONS.pop(channel_id, None) is not None
+    LAST_TEAM_ASSIGNMENT_UPDATED.pop(channel_id, None)
+    LAST_TEAM_DESTINATION_UPDATED.pop(channel_id, None)
+    _NONBOT_MEMBER_CACHE.pop(channel_id, None)
+    if removed:
+        schedule_persist()
+
+
+def _get_fresh_assignment(channel_id: int, now: float) -> TeamAssignment | None:
+    """Return the team assignment for a channel, expiring it if it is past the TTL."""
+
+    updated_at = LAST_TEAM_ASSIGNMENT_UPDATED.get(channel_id)
+    if updated_at is None:
+        return None
+    if now - updated_at > TEAM_STATE_TTL_SECONDS:
+        LAST_TEAM_ASSIGNMENTS.pop(channel_id, None)
+        LAST_TEAM_ASSIGNMENT_UPDATED.pop(channel_id, None)
+        schedule_persist()
+        return None
+    return LAST_TEAM_ASSIGNMENTS.get(channel_id)
+
+
+def _get_fresh_destinations(channel_id: int, now: float) -> TeamDestinations | None:
+    """Return the destination channels for a channel, expiring them if past the TTL."""
+
+    updated_at = LAST_TEAM_DESTINATION_UPDATED.get(channel_id)
+    if updated_at is None:
+        return None
+    if now - updated_at > TEAM_STATE_TTL_SECONDS:
+        LAST_TEAM_DESTINATIONS.pop(channel_id, None)
+        LAST_TEAM_DESTINATION_UPDATED.pop(channel_id, None)
+        schedule_persist()
+        return None
+    return LAST_TEAM_DESTINATIONS.get(channel_id)
 
 
 def prune_expired_entries(*, now: float | None = None) -> None:
     """Remove stale state entries that exceeded the retention window."""
 
     current_time = time.time() if now is None else now
+    cutoff = current_time - TEAM_STATE_TTL_SECONDS
     dirty = False
 
-    for channel_id, updated_at in list(LAST_TEAM_ASSIGNMENT_UPDATED.items()):
-        if current_time - updated_at > TEAM_STATE_TTL_SECONDS:
-            LAST_TEAM_ASSIGNMENTS.pop(channel_id, None)
-            LAST_TEAM_ASSIGNMENT_UPDATED.pop(channel_id, None)
-            dirty = True
+    while _EXPIRY_HEAP and _EXPIRY_HEAP[0][0] < cutoff:
+        updated_at, channel_id, kind = heapq.heappop(_EXPIRY_HEAP)
+        if kind == "assignment":
+            entries, timestamps = LAST_TEAM_ASSIGNMENTS, LAST_TEAM_ASSIGNMENT_UPDATED
+        else:
+            entries, timestamps = LAST_TEAM_DESTINATIONS, LAST_TEAM_DESTINATION_UPDATED
 
-    for channel_id, updated_at in list(LAST_TEAM_DESTINATION_UPDATED.items()):
-        if current_time - updated_at > TEAM_STATE_TTL_SECONDS:
-            LAST_TEAM_DESTINATIONS.pop(channel_id, None)
-            LAST_TEAM_DESTINATION_UPDATED.pop(channel_id, None)
-            dirty = True
+        if timestamps.get(channel_id) != updated_at:
+            continue
+
+        entries.pop(channel_id, None)
+        timestamps.pop(channel_id, None)
+        dirty = True
 
     if dirty:
-        persist_team_state()
+        schedule_persist()
 
 
 def load_persisted_team_state() -> None:
     """Load team state from disk, pruning any expired entries."""
 
-    if not TEAM_STATE_FILE.exists():
-        return
-
     try:
-        raw_data = json.loads(TEAM_STATE_FILE.read_text())
+        raw_data = decode_team_state(TEAM_STATE_FILE.read_bytes())
+    except FileNotFoundError:
+        return
     except (OSError, json.JSONDecodeError) as exc:
         print(f"Failed to load team state: {exc}")
         return
@@ -163,6 +538,8 @@ def load_persisted_team_state() -> None:
 
     now = time.time()
     dirty = False
+    loaded_assignments: list[tuple[float, int, TeamAssignment]] = []
+    loaded_destinations: list[tuple[float, int, TeamDestinations]] = []
 
     assignments = raw_data.get("assignments", {})
     for channel_id_str, record in assignments.items():
@@ -186,8 +563,7 @@ def load_persisted_team_state() -> None:
             dirty = True
             continue
 
-        LAST_TEAM_ASSIGNMENTS[channel_id] = assignment
-        LAST_TEAM_ASSIGNMENT_UPDATED[channel_id] = updated_at
+        loaded_assignments.append((updated_at, channel_id, assignment))
 
     destinations = raw_data.get("destinations", {})
     for channel_id_str, record in destinations.items():
@@ -211,8 +587,16 @@ def load_persisted_team_state() -> None:
             dirty = True
             continue
 
-        LAST_TEAM_DESTINATIONS[channel_id] = destination
-        LAST_TEAM_DESTINATION_UPDATED[channel_id] = updated_at
+        loaded_destinations.append((updated_at, channel_id, destination))
+
+    # Record oldest first so least-recently-updated eviction order survives a restart.
+    loaded_assignments.sort(key=lambda item: item[0])
+    for updated_at, channel_id, assignment in loaded_assignments:
+        record_team_assignment(channel_id, assignment, updated_at)
+
+    loaded_destinations.sort(key=lambda item: item[0])
+    for updated_at, channel_id, destination in loaded_destinations:
+        record_team_destinations(channel_id, destination, updated_at)
 
     if dirty:
         persist_team_state()
@@ -223,27 +607,51 @@ load_persisted_team_state()
 
 @tasks.loop(minutes=30)
 async def prune_team_state_loop() -> None:
+    """Drop expired entries that no command has looked up so they leave the state file."""
     prune_expired_entries()
 
 
+async def persist_team_state_worker() -> None:
+    """Coalesce persistence requests into at most one write per debounce window."""
+
+    while True:
+        await _PERSIST_REQUESTED.wait()
+        await asyncio.sleep(PERSIST_DEBOUNCE_SECONDS)
+        _PERSIST_REQUESTED.clear()
+        await persist_team_state_async()
+
+
 async def sync_application_commands(client: commands.Bot) -> None:
-    """Synchronize application commands for all connected guilds."""
-    if not client.guilds:
-        await client.tree.sync()
-        print("Synced global application commands (no guilds available yet).")
+    """Synchronize global application commands; guilds are not connected yet in setup_hook."""
+    await client.tree.sync()
+    print("Synced global application commands.")
+
+
+def command_tree_digest(tree: app_commands.CommandTree) -> str:
+    """Return a stable hash of the global application command payload."""
+    payload = [command.to_dict(tree) for command in tree.get_commands()]
+    encoded = json.dumps(payload, sort_keys=True).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+async def sync_command_tree_if_changed(client: commands.Bot, *, force: bool = False) -> None:
+    """Synchronize application commands only if they changed since the last recorded sync."""
+    digest = command_tree_digest(client.tree)
+    try:
+        previous_digest = COMMAND_TREE_HASH_FILE.read_text().strip()
+    except OSError:
+        previous_digest = None
+
+    if not force and digest == previous_digest:
+        print("Application commands unchanged since the last sync; skipping sync.")
         return
 
-    for guild in client.guilds:
-        try:
-            await client.tree.sync(guild=guild)
-        except discord.HTTPException as exc:
-            print(
-                f"Failed to sync application commands for guild: {guild.name} ({guild.id}) - {exc}"
-            )
-        else:
-            print(
-                f"Synced application commands for guild: {guild.name} ({guild.id})"
-            )
+    await sync_application_commands(client)
+
+    try:
+        COMMAND_TREE_HASH_FILE.write_text(digest)
+    except OSError as exc:
+        print(f"Failed to record application command hash: {exc}")
 
 
 @bot.event
@@ -251,42 +659,104 @@ async def on_ready() -> None:
     """Log readiness once Discord signals the client is ready."""
     print(f"Logged in as {bot.user} (ID: {bot.user.id})")
 
-    await sync_application_commands(bot)
+    # Voice state updates may have been missed while disconnected.
+    _NONBOT_MEMBER_CACHE.clear()
 
 
 @bot.event
 async def on_guild_join(guild: discord.Guild) -> None:
     """Ensure commands are available immediately after joining a new guild."""
+    forget_guild_rosters(guild)
     await bot.tree.sync(guild=guild)
     print(f"Synced application commands for newly joined guild: {guild.name} ({guild.id})")
 
 
+@bot.event
+async def on_guild_available(guild: discord.Guild) -> None:
+    """Rebuild voice rosters once a guild recovers from an outage."""
+    forget_guild_rosters(guild)
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild) -> None:
+    """Forget voice rosters for a guild the bot no longer belongs to."""
+    forget_guild_rosters(guild)
+
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel) -> None:
+    """Forget team state tied to a voice channel that no longer exists."""
+    forget_channel_state(channel.id)
+
+
+@bot.event
+async def on_voice_state_update(
+    member: discord.Member,
+    before: discord.VoiceState,
+    after: discord.VoiceState,
+) -> None:
+    """Keep cached rosters in step as a member leaves or joins voice channels."""
+    before_id = getattr(before.channel, "id", None)
+    after_id = getattr(after.channel, "id", None)
+    if member.bot or before_id == after_id:
+        return
+
+    # Replace rather than mutate cached lists so callers holding a roster never see it change.
+    if before_id is not None:
+        members = _NONBOT_MEMBER_CACHE.get(before_id)
+        if members is not None:
+            _NONBOT_MEMBER_CACHE[before_id] = [
+                existing for existing in members if existing.id != member.id
+            ]
+
+    if after_id is not None:
+        members = _NONBOT_MEMBER_CACHE.get(after_id)
+        if members is not None and all(
+            existing.id != member.id for existing in members
+        ):
+            _NONBOT_MEMBER_CACHE[after_id] = [*members, member]
+
+
+# Static replies for commands that cannot proceed.
+NOT_IN_VOICE_MESSAGE = "You must be in a voice channel to use this command."
+GUILD_ONLY_MESSAGE = "This command can only be used within a server."
+SAME_CAPTAIN_MESSAGE = "Red and blue captains must be different members."
+EXCLUDED_CAPTAIN_MESSAGE = "You cannot exclude yourself while also being a team captain."
+BOT_CAPTAIN_MESSAGE = "Bots cannot be captains."
+NOT_IN_VOICE_TO_MOVE_MESSAGE = "You must be in a voice channel to move the teams."
+FOREIGN_DESTINATION_MESSAGE = "Both destination channels must belong to this server."
+NO_TEAM_ASSIGNMENT_MESSAGE = "No team assignments found for this voice channel. Run /random_teams first."
+NOT_IN_VOICE_TO_RECONVENE_MESSAGE = "You must be in a voice channel to reconvene teams."
+NO_TEAM_MOVES_MESSAGE = "No recent team moves found for this voice channel. Run /move_teams first."
+
+
+async def send_error(interaction: discord.Interaction, message: str) -> None:
+    """Reply to an interaction with an ephemeral error message."""
+    await interaction.response.send_message(message, ephemeral=True)
+
+
 @bot.tree.command(name="random_winner", description="Pick a random member from your current voice channel")
 async def random_winner(
     interaction: discord.Interaction,
 ) -> None:
     """Select a random user in the provided voice channel."""
-    target_channel = getattr(interaction.user.voice, "channel", None)
+    # Users outside a guild have no voice attribute at all.
+    voice = getattr(interaction.user, "voice", None)
+    target_channel = getattr(voice, "channel", None)
 
     if target_channel is None:
-        await interaction.response.send_message(
-            "You must be in a voice channel to use this command.",
-            ephemeral=True,
-        )
+        await send_error(interaction, NOT_IN_VOICE_MESSAGE)
         return
 
-    members = [member for member in target_channel.members if not member.bot]
+    mention = target_channel.mention
+    members = get_nonbot_members(target_channel)
 
     if not members:
-        await interaction.response.send_message(
-            f"No eligible members found in {target_channel.mention}.",
-            ephemeral=True,
-        )
+        await send_error(interaction, f"No eligible members found in {mention}.")
         return
 
-    winner = random.choice(members)
     await interaction.response.send_message(
-        f"🎲 Selected {winner.mention} from {target_channel.mention}!"
+        f"🎲 Selected {random.choice(members).mention} from {mention}!"
     )
 
 
@@ -309,68 +779,55 @@ async def random_teams(
     target_channel = getattr(interaction.user.voice, "channel", None)
 
     if target_channel is None:
-        await interaction.response.send_message(
-            "You must be in a voice channel to use this command.",
-            ephemeral=True,
-        )
+        await send_error(interaction, NOT_IN_VOICE_MESSAGE)
         return
 
     if red_captain and red_captain == blue_captain:
-        await interaction.response.send_message(
-            "Red and blue captains must be different members.",
-            ephemeral=True,
-        )
+        await send_error(interaction, SAME_CAPTAIN_MESSAGE)
         return
 
     if not include_caller and interaction.user in (red_captain, blue_captain):
-        await interaction.response.send_message(
-            "You cannot exclude yourself while also being a team captain.",
-            ephemeral=True,
-        )
+        await send_error(interaction, EXCLUDED_CAPTAIN_MESSAGE)
         return
 
+    members = get_nonbot_members(target_channel)
+    member_ids = {member.id for member in members}
+
     for captain, colour in (
         (red_captain, "red"),
         (blue_captain, "blue"),
     ):
         if captain is None:
             continue
-        if captain not in target_channel.members:
-            await interaction.response.send_message(
-                f"The {colour} team captain must be in {target_channel.mention}.",
-                ephemeral=True,
-            )
-            return
         if captain.bot:
-            await interaction.response.send_message(
-                "Bots cannot be captains.",
-                ephemeral=True,
+            await send_error(interaction, BOT_CAPTAIN_MESSAGE)
+            return
+        if captain.id not in member_ids:
+            await send_error(
+                interaction,
+                f"The {colour} team captain must be in {target_channel.mention}.",
             )
             return
 
-    members = [
-        member
-        for member in target_channel.members
-        if not member.bot and (include_caller or member.id != interaction.user.id)
-    ]
+    if not include_caller:
+        members = [member for member in members if member.id != interaction.user.id]
 
     if len(members) < 2:
-        await interaction.response.send_message(
+        await send_error(
+            interaction,
             f"Need at least two eligible members in {target_channel.mention} to form teams.",
-            ephemeral=True,
         )
         return
 
-    shuffled_members = members[:]
-    random.shuffle(shuffled_members)
-
     excluded_captain_ids = {
         captain.id for captain in (red_captain, blue_captain) if captain is not None
     }
 
+    # Filtering builds a fresh list, so it can be shuffled without touching the cached roster.
     remaining_members = [
-        member for member in shuffled_members if member.id not in excluded_captain_ids
+        member for member in members if member.id not in excluded_captain_ids
     ]
+    random.shuffle(remaining_members)
 
     red_team = [red_captain] if red_captain else []
     blue_team = [blue_captain] if blue_captain else []
@@ -379,37 +836,28 @@ async def random_teams(
     base_team_size = total_members // 2
     extra_team: str | None = None
     if total_members % 2 == 1:
-        extra_team = random.choice(["red", "blue"])
+        extra_team = "red" if random.getrandbits(1) else "blue"
 
     team_targets = {
         "red": base_team_size + (1 if extra_team == "red" else 0),
         "blue": base_team_size + (1 if extra_team == "blue" else 0),
     }
 
-    for member in remaining_members:
-        possible_teams = [
-            team_name
-            for team_name, team_members in (("red", red_team), ("blue", blue_team))
-            if len(team_members) < team_targets[team_name]
-        ]
-        if possible_teams:
-            chosen_team = random.choice(possible_teams)
-        else:
-            chosen_team = "red" if len(red_team) <= len(blue_team) else "blue"
-        if chosen_team == "red":
-            red_team.append(member)
-        else:
-            blue_team.append(member)
-
-    def format_team_member(member: discord.Member, captain: discord.Member | None) -> str:
-        if captain and member.id == captain.id:
-            return f"⭐ {member.mention} (Captain)"
-        return member.mention
+    # The members are already shuffled and captains are always eligible, so filling the
+    # open red slots first and giving the rest to blue matches the team targets exactly.
+    red_slots = team_targets["red"] - len(red_team)
+    red_team.extend(remaining_members[:red_slots])
+    blue_team.extend(remaining_members[red_slots:])
 
     def build_team_field(team: list[discord.Member], captain: discord.Member | None) -> str:
         if not team:
             return "(none)"
-        return "\n".join(format_team_member(member, captain) for member in team)
+        # A captain is always placed first on their team.
+        if captain is None or team[0].id != captain.id:
+            return "\n".join(member.mention for member in team)
+        lines = [f"⭐ {team[0].mention} (Captain)"]
+        lines.extend(member.mention for member in itertools.islice(team, 1, None))
+        return "\n".join(lines)
 
     embed = discord.Embed(
         title=f"Random Teams for {target_channel.name}",
@@ -434,12 +882,15 @@ async def random_teams(
 
     await interaction.response.send_message(embed=embed)
 
-    LAST_TEAM_ASSIGNMENTS[target_channel.id] = TeamAssignment(
-        red_team_ids=[member.id for member in red_team],
-        blue_team_ids=[member.id for member in blue_team],
+    record_team_assignment(
+        target_channel.id,
+        TeamAssignment(
+            red_team_ids=[member.id for member in red_team],
+            blue_team_ids=[member.id for member in blue_team],
+        ),
+        time.time(),
     )
-    LAST_TEAM_ASSIGNMENT_UPDATED[target_channel.id] = time.time()
-    persist_team_state()
+    schedule_persist()
 
 
 @bot.tree.command(
@@ -458,119 +909,42 @@ async def move_teams(
     """Move the previously randomized teams into the provided voice channels."""
 
     if interaction.guild is None:
-        await interaction.response.send_message(
-            "This command can only be used within a server.",
-            ephemeral=True,
-        )
+        await send_error(interaction, GUILD_ONLY_MESSAGE)
         return
 
     current_channel = getattr(interaction.user.voice, "channel", None)
 
     if current_channel is None:
-        await interaction.response.send_message(
-            "You must be in a voice channel to move the teams.",
-            ephemeral=True,
-        )
+        await send_error(interaction, NOT_IN_VOICE_TO_MOVE_MESSAGE)
         return
 
     if red_voice.guild.id != interaction.guild.id or blue_voice.guild.id != interaction.guild.id:
-        await interaction.response.send_message(
-            "Both destination channels must belong to this server.",
-            ephemeral=True,
-        )
+        await send_error(interaction, FOREIGN_DESTINATION_MESSAGE)
         return
 
-    prune_expired_entries()
-
-    assignment = LAST_TEAM_ASSIGNMENTS.get(current_channel.id)
+    assignment = _get_fresh_assignment(current_channel.id, time.time())
     if assignment is None:
-        await interaction.response.send_message(
-            "No team assignments found for this voice channel. Run /random_teams first.",
-            ephemeral=True,
-        )
+        await send_error(interaction, NO_TEAM_ASSIGNMENT_MESSAGE)
         return
 
     await interaction.response.defer(ephemeral=True)
 
-    fetch_semaphore = asyncio.Semaphore(5)
-    move_semaphore = asyncio.Semaphore(5)
-
-    async def resolve_members(member_ids: list[int]) -> dict[int, discord.Member | None]:
-        resolved: dict[int, discord.Member | None] = {}
-        missing: list[int] = []
-
-        for member_id in member_ids:
-            member = interaction.guild.get_member(member_id)
-            if member is not None:
-                resolved[member_id] = member
-            else:
-                missing.append(member_id)
-
-        if missing:
-            async def fetch_with_limit(member_id: int) -> discord.Member | None:
-                async with fetch_semaphore:
-                    try:
-                        return await interaction.guild.fetch_member(member_id)
-                    except (discord.NotFound, discord.HTTPException, discord.Forbidden):
-                        return None
-
-            results = await asyncio.gather(
-                *(fetch_with_limit(member_id) for member_id in missing)
-            )
-            for member_id, member in zip(missing, results):
-                resolved[member_id] = member
-
-        return resolved
-
-    unique_member_ids = list({*assignment.red_team_ids, *assignment.blue_team_ids})
-    resolved_members = await resolve_members(unique_member_ids)
-
-    async def move_members(
-        member_ids: List[int],
-        destination: discord.VoiceChannel,
-    ) -> tuple[list[str], list[str]]:
-        async def process_member(
-            member_id: int,
-        ) -> tuple[str | None, str | None]:
-            member = resolved_members.get(member_id)
-            if member is None:
-                return None, f"<@{member_id}> (not found)"
-            if member.voice is None or member.voice.channel is None:
-                return None, f"{member.mention} (not in a voice channel)"
-            if member.voice.channel.id == destination.id:
-                return member.mention, None
-            async with move_semaphore:
-                try:
-                    await member.move_to(destination)
-                except (discord.HTTPException, discord.Forbidden) as exc:
-                    return None, f"{member.mention} (failed to move: {exc})"
-                else:
-                    await asyncio.sleep(MEMBER_MOVE_DELAY_SECONDS)
-            return member.mention, None
-
-        tasks = [process_member(member_id) for member_id in dict.fromkeys(member_ids)]
-        if not tasks:
-            return [], []
-
-        results = await asyncio.gather(*tasks)
-        moved_mentions: list[str] = []
-        skipped_messages: list[str] = []
-
-        for moved, skipped in results:
-            if moved is not None:
-                moved_mentions.append(moved)
-            if skipped is not None:
-                skipped_messages.append(skipped)
-
-        return moved_mentions, skipped_messages
-
-    team_results = []
-    for team_name, member_ids, channel in (
-        ("Red", assignment.red_team_ids, red_voice),
-        ("Blue", assignment.blue_team_ids, blue_voice),
-    ):
-        moved, skipped = await move_members(member_ids, channel)
-        team_results.append((team_name, channel, moved, skipped))
+    move_bucket = get_member_move_bucket(interaction.guild.id)
+
+    # Dedupe in a single pass while keeping the shuffled team order.
+    unique_member_ids = list(
+        dict.fromkeys([*assignment.red_team_ids, *assignment.blue_team_ids])
+    )
+    resolved_members = await resolve_members(interaction.guild, unique_member_ids, {})
+
+    (red_moved, red_skipped), (blue_moved, blue_skipped) = await asyncio.gather(
+        move_members_to(assignment.red_team_ids, resolved_members, red_voice, move_bucket),
+        move_members_to(assignment.blue_team_ids, resolved_members, blue_voice, move_bucket),
+    )
+    team_results = [
+        ("Red", red_voice, red_moved, red_skipped),
+        ("Blue", blue_voice, blue_moved, blue_skipped),
+    ]
 
     lines: list[str] = []
     for team_name, channel, moved, skipped in team_results:
@@ -585,12 +959,15 @@ async def move_teams(
 
     await interaction.followup.send("\n".join(lines), ephemeral=True)
 
-    LAST_TEAM_DESTINATIONS[current_channel.id] = TeamDestinations(
-        red_voice_id=red_voice.id,
-        blue_voice_id=blue_voice.id,
-    )
-    LAST_TEAM_DESTINATION_UPDATED[current_channel.id] = time.time()
-    persist_team_state()
+    now = time.time()
+    destinations = TeamDestinations(red_voice_id=red_voice.id, blue_voice_id=blue_voice.id)
+    # Re-recording the same destinations would only bump the timestamp and force a write.
+    if (
+        _get_fresh_destinations(current_channel.id, now) != destinations
+        or now - LAST_TEAM_DESTINATION_UPDATED[current_channel.id] > TEAM_STATE_REFRESH_SECONDS
+    ):
+        record_team_destinations(current_channel.id, destinations, now)
+        schedule_persist()
 
 
 @bot.tree.command(
@@ -601,93 +978,62 @@ async def reconvene(interaction: discord.Interaction) -> None:
     """Bring the last moved teams back into the caller's current voice channel."""
 
     if interaction.guild is None:
-        await interaction.response.send_message(
-            "This command can only be used within a server.",
-            ephemeral=True,
-        )
+        await send_error(interaction, GUILD_ONLY_MESSAGE)
         return
 
     target_channel = getattr(interaction.user.voice, "channel", None)
 
     if target_channel is None:
-        await interaction.response.send_message(
-            "You must be in a voice channel to reconvene teams.",
-            ephemeral=True,
-        )
+        await send_error(interaction, NOT_IN_VOICE_TO_RECONVENE_MESSAGE)
         return
 
-    prune_expired_entries()
-
-    destinations = LAST_TEAM_DESTINATIONS.get(target_channel.id)
+    now = time.time()
+    destinations = _get_fresh_destinations(target_channel.id, now)
 
     if destinations is None:
-        await interaction.response.send_message(
-            "No recent team moves found for this voice channel. Run /move_teams first.",
-            ephemeral=True,
-        )
+        await send_error(interaction, NO_TEAM_MOVES_MESSAGE)
         return
 
-    red_channel = interaction.guild.get_channel(destinations.red_voice_id)
-    blue_channel = interaction.guild.get_channel(destinations.blue_voice_id)
-
-    for channel, colour in ((red_channel, "red"), (blue_channel, "blue")):
+    voice_channels: list[discord.VoiceChannel] = []
+    for channel_id, colour in (
+        (destinations.red_voice_id, "red"),
+        (destinations.blue_voice_id, "blue"),
+    ):
+        channel = interaction.guild.get_channel(channel_id)
         if not isinstance(channel, discord.VoiceChannel):
-            await interaction.response.send_message(
+            await send_error(
+                interaction,
                 f"The {colour} team channel could not be found. Run /move_teams again.",
-                ephemeral=True,
             )
             return
+        voice_channels.append(channel)
+
+    red_channel, blue_channel = voice_channels
 
     await interaction.response.defer(ephemeral=True)
 
-    assignment = LAST_TEAM_ASSIGNMENTS.get(target_channel.id)
+    assignment = _get_fresh_assignment(target_channel.id, now)
 
-    async def resolve_member(member_id: int) -> discord.Member | None:
-        member = interaction.guild.get_member(member_id)
-        if member is not None:
-            return member
-        try:
-            return await interaction.guild.fetch_member(member_id)
-        except discord.NotFound:
-            return None
-
-    async def move_back_member(member: discord.Member) -> tuple[str | None, str | None]:
-        if member.bot:
-            return None, None
-        if member.voice is None or member.voice.channel is None:
-            return None, f"{member.mention} (not in a voice channel)"
-        if member.voice.channel.id == target_channel.id:
-            return member.mention, None
-        try:
-            await member.move_to(target_channel)
-        except (discord.HTTPException, discord.Forbidden) as exc:
-            return None, f"{member.mention} (failed to move: {exc})"
-        else:
-            return member.mention, None
+    move_bucket = get_member_move_bucket(interaction.guild.id)
 
-    member_ids: set[int] = set()
+    # Seed the resolver with members already in the destination channels.
+    resolved_members: dict[int, discord.Member | None] = {
+        member.id: member
+        for member in itertools.chain(
+            get_nonbot_members(red_channel), get_nonbot_members(blue_channel)
+        )
+    }
+    member_ids: set[int] = set(resolved_members)
 
     if assignment is not None:
         member_ids.update(assignment.red_team_ids)
         member_ids.update(assignment.blue_team_ids)
 
-    for channel in (red_channel, blue_channel):
-        member_ids.update(member.id for member in channel.members if not member.bot)
+    await resolve_members(interaction.guild, member_ids, resolved_members)
 
-    moved_mentions: list[str] = []
-    skipped_messages: list[str] = []
-
-    for member_id in member_ids:
-        member = await resolve_member(member_id)
-        if member is None:
-            skipped_messages.append(f"<@{member_id}> (not found)")
-            continue
-
-        mention, skipped = await move_back_member(member)
-        if mention is not None:
-            moved_mentions.append(mention)
-        if skipped is not None:
-            skipped_messages.append(skipped)
+    moved_mentions, skipped_messages = await move_members_to(
+        member_ids, resolved_members, target_channel, move_bucket
+    )
 
     lines = [
         f"Moved {len(moved_mentions)} member(s) back to {target_channel.mention}."
@@ -704,8 +1050,30 @@ async def reconvene(interaction: discord.Interaction) -> None:
 
 def main() -> None:
     """Entrypoint to run the bot."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Sync application commands with Discord even if they have not changed.",
+    )
+    args = parser.parse_args()
+    bot.force_command_sync = args.sync
+
     token = get_token()
-    bot.run(token)
+    if uvloop is None:
+        bot.run(token)
+        return
+
+    async def runner() -> None:
+        async with bot:
+            await bot.start(token)
+
+    # Mirror bot.run(), but let uvloop create the loop instead of the deprecated global policy.
+    discord.utils.setup_logging(root=False)
+    try:
+        uvloop.run(runner())
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":